@@ -1,104 +1,210 @@
 # File: propositions/operators.py
 """Syntactic conversion of propositional formulas to use only specific sets of operators."""
 
+from typing import Callable, Optional
+
 from propositions.syntax import Formula, is_variable, is_constant, is_unary
 
-def to_not_and_or(formula: Formula) -> Formula:
-    if is_variable(formula.root):
-        return formula
-    if is_constant(formula.root):
-        if formula.root == "T":
+#: A node-level conversion rule: maps a node and its already-converted
+#: operands (``None`` where absent) to the converted formula.
+ConversionRule = Callable[[Formula, Optional[Formula], Optional[Formula]], Formula]
+
+def _convert_postorder(formula: Formula, convert_node: ConversionRule) -> Formula:
+    # Applies convert_node bottom-up over the formula tree with an explicit
+    # stack, avoiding Python recursion (and its depth limit) per node.
+    # Subtrees shared by identity are converted once via an id-keyed memo,
+    # collapsing the duplicate work created by expansions (e.g. of '+'/'<->')
+    # that reference the same operand twice. The memo is scoped to this call,
+    # so entries never outlive the input tree and cannot alias recycled ids.
+    memo = {}
+    work = [(formula, False)]
+    values = []
+    while work:
+        node, ready = work.pop()
+        node_id = id(node)
+        if node_id in memo:
+            values.append(memo[node_id])
+            continue
+        root = node.root
+        if is_variable(root) or is_constant(root):
+            result = convert_node(node, None, None)
+        elif not ready:
+            work.append((node, True))
+            if not is_unary(root):
+                work.append((node.second, False))
+            work.append((node.first, False))
+            continue
+        elif is_unary(root):
+            result = convert_node(node, values.pop(), None)
+        else:
+            second = values.pop()
+            first = values.pop()
+            result = convert_node(node, first, second)
+        memo[node_id] = result
+        values.append(result)
+    return values[0]
+
+def _not_and_or_rule(node: Formula, left: Optional[Formula], right: Optional[Formula]) -> Formula:
+    root = node.root
+    if is_variable(root):
+        return node
+    if is_constant(root):
+        if root == "T":
             return Formula("|", Formula("p"), Formula("~", Formula("p")))
         else:
             return Formula("&", Formula("p"), Formula("~", Formula("p")))
-    if is_unary(formula.root):
-        return Formula("~", to_not_and_or(formula.first))
-    left = to_not_and_or(formula.first)
-    right = to_not_and_or(formula.second)
-    op = formula.root
-    if op in {"&", "|"}:
-        return Formula(op, left, right)
-    elif op == "->":
+    if is_unary(root):
+        return Formula("~", left)
+    if root in {"&", "|"}:
+        return Formula(root, left, right)
+    elif root == "->":
         return Formula("|", Formula("~", left), right)
-    elif op == "+":
+    elif root == "+":
         return Formula("&", Formula("|", left, right), Formula("~", Formula("&", left, right)))
-    elif op == "<->":
+    elif root == "<->":
         return Formula("|", Formula("&", left, right), Formula("&", Formula("~", left), Formula("~", right)))
-    elif op == "-&":
+    elif root == "-&":
         return Formula("~", Formula("&", left, right))
-    elif op == "-|":
+    elif root == "-|":
         return Formula("~", Formula("|", left, right))
     else:
-        raise Exception("Unknown operator in to_not_and_or: " + op)
+        raise Exception("Unknown operator in to_not_and_or: " + root)
 
-def to_not_and(formula: Formula) -> Formula:
-    f = to_not_and_or(formula)
-    if is_variable(f.root) or is_constant(f.root):
-        return f
-    if is_unary(f.root):
-        return Formula("~", to_not_and(f.first))
-    left = to_not_and(f.first)
-    right = to_not_and(f.second)
-    if f.root == "&":
+def to_not_and_or(formula: Formula) -> Formula:
+    return _convert_postorder(formula, _not_and_or_rule)
+
+def _not_and_rule(node: Formula, left: Optional[Formula], right: Optional[Formula]) -> Formula:
+    root = node.root
+    if is_variable(root):
+        return node
+    if is_constant(root):
+        contradiction = Formula("&", Formula("p"), Formula("~", Formula("p")))
+        return Formula("~", contradiction) if root == "T" else contradiction
+    if is_unary(root):
+        return Formula("~", left)
+    if root == "&":
         return Formula("&", left, right)
-    elif f.root == "|":
+    elif root == "|":
         return Formula("~", Formula("&", Formula("~", left), Formula("~", right)))
+    elif root == "->":
+        return Formula("~", Formula("&", left, Formula("~", right)))
+    elif root == "+":
+        # l+r == (l&~r) | (~l&r), with the disjunction de-Morganed away.
+        return Formula(
+            "~",
+            Formula(
+                "&",
+                Formula("~", Formula("&", left, Formula("~", right))),
+                Formula("~", Formula("&", Formula("~", left), right)),
+            ),
+        )
+    elif root == "<->":
+        return Formula(
+            "&",
+            Formula("~", Formula("&", left, Formula("~", right))),
+            Formula("~", Formula("&", Formula("~", left), right)),
+        )
+    elif root == "-&":
+        return Formula("~", Formula("&", left, right))
+    elif root == "-|":
+        return Formula("&", Formula("~", left), Formula("~", right))
     else:
-        raise Exception("Unexpected operator in to_not_and: " + f.root)
+        raise Exception("Unknown operator in to_not_and: " + root)
+
+def to_not_and(formula: Formula) -> Formula:
+    return _convert_postorder(formula, _not_and_rule)
+
+def _nand_rule(node: Formula, left: Optional[Formula], right: Optional[Formula]) -> Formula:
+    def nand_not(f: Formula) -> Formula:
+        return Formula("-&", f, f)
+
+    root = node.root
+    if is_variable(root):
+        return node
+    if is_constant(root):
+        p = Formula("p")
+        tautology = Formula("-&", p, nand_not(p))
+        return tautology if root == "T" else nand_not(tautology)
+    if is_unary(root):
+        return nand_not(left)
+    if root == "&":
+        return nand_not(Formula("-&", left, right))
+    elif root == "|":
+        return Formula("-&", nand_not(left), nand_not(right))
+    elif root == "->":
+        return Formula("-&", left, nand_not(right))
+    elif root == "+":
+        return nand_not(Formula("-&", Formula("-&", left, right), Formula("-&", nand_not(left), nand_not(right))))
+    elif root == "<->":
+        return Formula("-&", Formula("-&", left, right), Formula("-&", nand_not(left), nand_not(right)))
+    elif root == "-&":
+        return Formula("-&", left, right)
+    elif root == "-|":
+        return nand_not(Formula("-&", nand_not(left), nand_not(right)))
+    else:
+        raise Exception("Unknown operator in to_nand: " + root)
 
 def to_nand(formula: Formula) -> Formula:
-    f = to_not_and(formula)
-    if is_variable(f.root) or is_constant(f.root):
-        return f
-    if is_unary(f.root):
-        sub = to_nand(f.first)
-        return Formula("-&", sub, sub)
-    left = to_nand(f.first)
-    right = to_nand(f.second)
-    nand_expr = Formula("-&", left, right)
-    return Formula("-&", nand_expr, nand_expr)
+    return _convert_postorder(formula, _nand_rule)
 
-def to_implies_not(formula: Formula) -> Formula:
-    f = to_not_and_or(formula)
-    if is_variable(f.root) or is_constant(f.root):
-        if is_constant(f.root):
-            if f.root == "T":
-                return Formula("->", Formula("p"), Formula("p"))
-            else:
-                return Formula("->", Formula("p"), Formula("~", Formula("p")))
-        return f
-    if is_unary(f.root):
-        return Formula("~", to_implies_not(f.first))
-    left = to_implies_not(f.first)
-    right = to_implies_not(f.second)
-    if f.root == "&":
+def _implies_not_rule(node: Formula, left: Optional[Formula], right: Optional[Formula]) -> Formula:
+    root = node.root
+    if is_variable(root):
+        return node
+    if is_constant(root):
+        tautology = Formula("->", Formula("p"), Formula("p"))
+        return tautology if root == "T" else Formula("~", tautology)
+    if is_unary(root):
+        return Formula("~", left)
+    if root == "&":
         return Formula("~", Formula("->", left, Formula("~", right)))
-    elif f.root == "|":
+    elif root == "|":
         return Formula("->", Formula("~", left), right)
-    elif f.root == "->":
+    elif root == "->":
         return Formula("->", left, right)
+    elif root == "+":
+        # l+r == ~(l<->r) == (l->r) -> ~(r->l).
+        return Formula("->", Formula("->", left, right), Formula("~", Formula("->", right, left)))
+    elif root == "<->":
+        return Formula("~", Formula("->", Formula("->", left, right), Formula("~", Formula("->", right, left))))
+    elif root == "-&":
+        return Formula("->", left, Formula("~", right))
+    elif root == "-|":
+        return Formula("~", Formula("->", Formula("~", left), right))
     else:
-        raise Exception("Unexpected operator in to_implies_not: " + f.root)
+        raise Exception("Unknown operator in to_implies_not: " + root)
 
-def to_implies_false(formula: Formula) -> Formula:
-    f = to_not_and_or(formula)
-    if is_variable(f.root) or is_constant(f.root):
-        if is_constant(f.root):
-            if f.root == "T":
-                return Formula("->", Formula("p"), Formula("p"))
-            else:
-                return Formula("->", Formula("p"), Formula("~", Formula("p")))
-        return f
-    if is_unary(f.root):
-        sub = to_implies_false(f.first)
-        return Formula("->", sub, Formula("F"))
-    left = to_implies_false(f.first)
-    right = to_implies_false(f.second)
-    if f.root == "&":
-        return Formula("->", Formula("->", left, Formula("->", right, Formula("F"))), Formula("F"))
-    elif f.root == "|":
-        return Formula("->", Formula("->", left, Formula("F")), right)
-    elif f.root == "->":
+def to_implies_not(formula: Formula) -> Formula:
+    return _convert_postorder(formula, _implies_not_rule)
+
+def _implies_false_rule(node: Formula, left: Optional[Formula], right: Optional[Formula]) -> Formula:
+    def implies_not(f: Formula) -> Formula:
+        return Formula("->", f, Formula("F"))
+
+    root = node.root
+    if is_variable(root):
+        return node
+    if is_constant(root):
+        return Formula("->", Formula("p"), Formula("p")) if root == "T" else Formula("F")
+    if is_unary(root):
+        return implies_not(left)
+    if root == "&":
+        return implies_not(Formula("->", left, implies_not(right)))
+    elif root == "|":
+        return Formula("->", implies_not(left), right)
+    elif root == "->":
         return Formula("->", left, right)
+    elif root == "+":
+        # l+r == (l->r) -> ~(r->l).
+        return Formula("->", Formula("->", left, right), implies_not(Formula("->", right, left)))
+    elif root == "<->":
+        return implies_not(Formula("->", Formula("->", left, right), implies_not(Formula("->", right, left))))
+    elif root == "-&":
+        return Formula("->", left, implies_not(right))
+    elif root == "-|":
+        return implies_not(Formula("->", implies_not(left), right))
     else:
-        raise Exception("Unexpected operator in to_implies_false: " + f.root)
+        raise Exception("Unknown operator in to_implies_false: " + root)
+
+def to_implies_false(formula: Formula) -> Formula:
+    return _convert_postorder(formula, _implies_false_rule)
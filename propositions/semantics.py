@@ -1,8 +1,10 @@
 # File: propositions/semantics.py
 """Semantic analysis of propositional-logic constructs."""
 
+import sys
 from itertools import product
-from typing import Iterable, Mapping
+from typing import Callable, Iterable, List, Mapping, Tuple
+from weakref import WeakKeyDictionary
 from propositions.proofs import *
 from propositions.syntax import *
 
@@ -21,136 +23,384 @@ def variables(model: Model) -> AbstractSet[str]:
 def evaluate(formula: Formula, model: Model) -> bool:
     assert is_model(model)
     assert formula.variables().issubset(variables(model))
-    if is_variable(formula.root):
-        return model[formula.root]
-    elif is_constant(formula.root):
-        return True if formula.root == "T" else False
-    elif is_unary(formula.root):
-        return not evaluate(formula.first, model)
-    else:
-        left_val = evaluate(formula.first, model)
-        right_val = evaluate(formula.second, model)
-        if formula.root == "&":
-            return left_val and right_val
-        elif formula.root == "|":
-            return left_val or right_val
-        elif formula.root == "->":
-            return (not left_val) or right_val
-        elif formula.root == "+":
-            return (left_val and not right_val) or (not left_val and right_val)
-        elif formula.root == "<->":
-            return left_val == right_val
-        elif formula.root == "-&":
-            return not (left_val and right_val)
-        elif formula.root == "-|":
-            return not (left_val or right_val)
+    # States: 0 — node not yet visited, 1 — left operand evaluated (decide
+    # whether the right operand is needed at all), 2 — both operands evaluated.
+    work = [(formula, 0)]
+    values = []
+    while work:
+        node, state = work.pop()
+        root = node.root
+        if state == 0:
+            if is_variable(root):
+                values.append(model[root])
+            elif is_constant(root):
+                values.append(root == "T")
+            else:
+                work.append((node, 1))
+                work.append((node.first, 0))
+        elif state == 1:
+            if is_unary(root):
+                values.append(not values.pop())
+                continue
+            left_val = values[-1]
+            # For '&', '|' and '->' a decisive left operand settles the result
+            # without ever descending into the right subtree.
+            if root == "&" and not left_val:
+                values[-1] = False
+            elif root == "|" and left_val:
+                values[-1] = True
+            elif root == "->" and not left_val:
+                values[-1] = True
+            else:
+                work.append((node, 2))
+                work.append((node.second, 0))
         else:
-            raise Exception("Неизвестный оператор: " + formula.root)
+            right_val = values.pop()
+            left_val = values.pop()
+            if root == "&":
+                values.append(left_val and right_val)
+            elif root == "|":
+                values.append(left_val or right_val)
+            elif root == "->":
+                values.append((not left_val) or right_val)
+            elif root == "+":
+                values.append(left_val != right_val)
+            elif root == "<->":
+                values.append(left_val == right_val)
+            elif root == "-&":
+                values.append(not (left_val and right_val))
+            elif root == "-|":
+                values.append(not (left_val or right_val))
+            else:
+                raise Exception("Неизвестный оператор: " + root)
+    return values[0]
 
-def all_models(variables: Sequence[str]) -> Iterable[Model]:
+def all_models_rows(variables: Sequence[str]) -> List[Tuple[bool, ...]]:
+    # Packed-row form of `all_models`: one tuple of booleans per model, in the
+    # same enumeration order, with no per-model dict allocation or string-keyed
+    # lookups. Internal consumers index rows by position.
     for v in variables:
         assert is_variable(v)
-    for values in product([False, True], repeat=len(variables)):
-        yield {v: val for v, val in zip(variables, values)}
+    return list(product([False, True], repeat=len(variables)))
+
+def all_models(variables: Sequence[str]) -> Iterable[Model]:
+    for row in all_models_rows(variables):
+        yield {v: val for v, val in zip(variables, row)}
 
 def truth_values(formula: Formula, models: Iterable[Model]) -> Iterable[bool]:
-    return (evaluate(formula, model) for model in models)
+    flat = _flatten(formula)
+    for model in models:
+        assert is_model(model)
+        assert formula.variables().issubset(variables(model))
+        yield flat.evaluate([model[v] for v in flat.var_names])
 
 def print_truth_table(formula: Formula) -> None:
-    vars_sorted = sorted(formula.variables())
+    vars_sorted = formula.variables_sorted()
+    n = len(vars_sorted)
+    # One truth_mask call yields the whole value column at once; each row then
+    # just reads bits, instead of materializing a model dict and re-walking
+    # the formula 2^n times.
+    mask = truth_mask(formula, {v: j for j, v in enumerate(vars_sorted)}, n)
     headers = list(vars_sorted) + [str(formula)]
     widths = [max(len(h), 1) for h in headers]
-    def format_cell(text, width):
-        return f" {text:^{width}} "
-    header_line = "|" + "|".join(format_cell(h, w) for h, w in zip(headers, widths)) + "|"
-    separator_line = "|" + "|".join("-" * (w + 2) for w in widths) + "|"
-    print(header_line)
-    print(separator_line)
-    models_list = list(all_models(vars_sorted))
-    for model in models_list:
-        row_cells = [format_cell("T" if model[v] else "F", w) for v, w in zip(vars_sorted, widths[:-1])]
-        formula_val = "T" if evaluate(formula, model) else "F"
-        row_cells.append(format_cell(formula_val, widths[-1]))
-        row_line = "|" + "|".join(row_cells) + "|"
-        print(row_line)
+    # One precomputed row template and a single write for the whole table,
+    # instead of re-deriving the cell layout and issuing a print per row.
+    row_fmt = "|" + "|".join(f" {{:^{w}}} " for w in widths) + "|\n"
+    lines = [
+        row_fmt.format(*headers),
+        "|" + "|".join("-" * (w + 2) for w in widths) + "|\n",
+    ]
+    for i in range(1 << n):
+        row = ["T" if (i >> (n - 1 - j)) & 1 else "F" for j in range(n)]
+        row.append("T" if (mask >> i) & 1 else "F")
+        lines.append(row_fmt.format(*row))
+    sys.stdout.write("".join(lines))
+
+# Opcodes of the flat program produced by `_compile_ops`.
+_OP_VAR = 0
+_OP_TRUE = 1
+_OP_FALSE = 2
+_OP_NOT = 3
+_OP_AND = 4
+_OP_OR = 5
+_OP_IMPLIES = 6
+_OP_XOR = 7
+_OP_IFF = 8
+_OP_NAND = 9
+_OP_NOR = 10
+
+_BINARY_OP_CODES = {"&": _OP_AND, "|": _OP_OR, "->": _OP_IMPLIES, "+": _OP_XOR,
+                    "<->": _OP_IFF, "-&": _OP_NAND, "-|": _OP_NOR}
+
+class _FlatFormula:
+    """A structure-of-arrays view of a formula: parallel post-order sequences
+    of opcodes and operand slot indices, plus the distinct variable names.
+    Bulk semantic routines iterate these dense sequences instead of chasing
+    per-node `Formula` objects; interned subtrees occupy a single shared slot.
+
+    Attributes:
+        codes (Sequence[int]): the opcode of each slot, in post-order.
+        arg1 (Sequence[int]): for operators, the slot of the first operand;
+            for variables, the index into `var_names`.
+        arg2 (Sequence[int]): for binary operators, the slot of the second
+            operand.
+        var_names (Sequence[str]): the distinct variable names of the formula,
+            in first-occurrence order of the flattening.
+    """
+
+    def __init__(self, formula: Formula):
+        codes = []
+        arg1 = []
+        arg2 = []
+        var_names = []
+        var_slots = {}
+        slot_of = {}
+        work = [(formula, False)]
+        while work:
+            node, ready = work.pop()
+            node_id = id(node)
+            if node_id in slot_of:
+                continue
+            root = node.root
+            if is_variable(root):
+                if root not in var_slots:
+                    var_slots[root] = len(var_names)
+                    var_names.append(root)
+                codes.append(_OP_VAR)
+                arg1.append(var_slots[root])
+                arg2.append(0)
+            elif is_constant(root):
+                codes.append(_OP_TRUE if root == "T" else _OP_FALSE)
+                arg1.append(0)
+                arg2.append(0)
+            elif not ready:
+                work.append((node, True))
+                if not is_unary(root):
+                    work.append((node.second, False))
+                work.append((node.first, False))
+                continue
+            elif is_unary(root):
+                codes.append(_OP_NOT)
+                arg1.append(slot_of[id(node.first)])
+                arg2.append(0)
+            else:
+                if root not in _BINARY_OP_CODES:
+                    raise Exception("Неизвестный оператор: " + root)
+                codes.append(_BINARY_OP_CODES[root])
+                arg1.append(slot_of[id(node.first)])
+                arg2.append(slot_of[id(node.second)])
+            slot_of[node_id] = len(codes) - 1
+        self.codes = codes
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.var_names = var_names
+        self._mask_function = None
+        self._mask_calls = 0
+
+    def evaluate(self, assignment: Sequence[bool]) -> bool:
+        # Evaluates the flat program for one model, where assignment[k] is the
+        # value of var_names[k].
+        codes = self.codes
+        arg1 = self.arg1
+        arg2 = self.arg2
+        values = [False] * len(codes)
+        for i in range(len(codes)):
+            code = codes[i]
+            a = arg1[i]
+            if code == _OP_VAR:
+                values[i] = assignment[a]
+            elif code == _OP_TRUE:
+                values[i] = True
+            elif code == _OP_FALSE:
+                values[i] = False
+            elif code == _OP_NOT:
+                values[i] = not values[a]
+            else:
+                left = values[a]
+                right = values[arg2[i]]
+                if code == _OP_AND:
+                    values[i] = left and right
+                elif code == _OP_OR:
+                    values[i] = left or right
+                elif code == _OP_IMPLIES:
+                    values[i] = (not left) or right
+                elif code == _OP_XOR:
+                    values[i] = left != right
+                elif code == _OP_IFF:
+                    values[i] = left == right
+                elif code == _OP_NAND:
+                    values[i] = not (left and right)
+                else:
+                    values[i] = not (left or right)
+        return values[-1]
+
+    def _compile_mask_function(self) -> Callable[[List[int], int], int]:
+        # Generates Python source with one assignment per slot of the flat
+        # program and compiles it once: re-running the program becomes straight-
+        # line bytecode with no opcode dispatch. The statements are linear, so
+        # the compiled code stays shallow regardless of formula depth.
+        lines = ["def _mask(columns, all_ones):"]
+        templates = {
+            _OP_VAR: "v{i} = columns[{a}]",
+            _OP_TRUE: "v{i} = all_ones",
+            _OP_FALSE: "v{i} = 0",
+            _OP_NOT: "v{i} = v{a} ^ all_ones",
+            _OP_AND: "v{i} = v{a} & v{b}",
+            _OP_OR: "v{i} = v{a} | v{b}",
+            _OP_IMPLIES: "v{i} = (v{a} ^ all_ones) | v{b}",
+            _OP_XOR: "v{i} = v{a} ^ v{b}",
+            _OP_IFF: "v{i} = (v{a} ^ v{b}) ^ all_ones",
+            _OP_NAND: "v{i} = (v{a} & v{b}) ^ all_ones",
+            _OP_NOR: "v{i} = (v{a} | v{b}) ^ all_ones",
+        }
+        for i, code in enumerate(self.codes):
+            lines.append("    " + templates[code].format(i=i, a=self.arg1[i], b=self.arg2[i]))
+        lines.append(f"    return v{len(self.codes) - 1}")
+        namespace = {}
+        exec(compile("\n".join(lines), "<formula mask>", "exec"), namespace)
+        return namespace["_mask"]
+
+    def truth_mask(self, var_index: Mapping[str, int], n: int) -> int:
+        size = 1 << n
+        all_ones = (1 << size) - 1
+        columns = []
+        for v in self.var_names:
+            # Variable j alternates in blocks of 2^(n-1-j): zeros, then ones.
+            block = 1 << (n - 1 - var_index[v])
+            columns.append((all_ones // ((1 << block) + 1)) << block)
+        # Tiered execution: the first query of a formula runs the interpreter
+        # loop below, and a repeat query triggers one-time code generation —
+        # one-shot checks never pay the compile, repeated ones stop paying
+        # dispatch. The flat program (and hence this cache) is shared through
+        # the weak per-formula cache in _flatten.
+        if self._mask_function is not None:
+            return self._mask_function(columns, all_ones)
+        if self._mask_calls:
+            self._mask_function = self._compile_mask_function()
+            return self._mask_function(columns, all_ones)
+        self._mask_calls = 1
+        codes = self.codes
+        arg1 = self.arg1
+        arg2 = self.arg2
+        values = [0] * len(codes)
+        for i in range(len(codes)):
+            code = codes[i]
+            a = arg1[i]
+            if code == _OP_VAR:
+                values[i] = columns[a]
+            elif code == _OP_TRUE:
+                values[i] = all_ones
+            elif code == _OP_FALSE:
+                values[i] = 0
+            elif code == _OP_NOT:
+                values[i] = values[a] ^ all_ones
+            else:
+                left = values[a]
+                right = values[arg2[i]]
+                if code == _OP_AND:
+                    values[i] = left & right
+                elif code == _OP_OR:
+                    values[i] = left | right
+                elif code == _OP_IMPLIES:
+                    values[i] = (left ^ all_ones) | right
+                elif code == _OP_XOR:
+                    values[i] = left ^ right
+                elif code == _OP_IFF:
+                    values[i] = (left ^ right) ^ all_ones
+                elif code == _OP_NAND:
+                    values[i] = (left & right) ^ all_ones
+                else:
+                    values[i] = (left | right) ^ all_ones
+        return values[-1]
+
+_flat_formula_cache: WeakKeyDictionary = WeakKeyDictionary()
+
+def _flatten(formula: Formula) -> _FlatFormula:
+    # Flat programs are cached per formula (weakly, to not keep formulas
+    # alive), so repeated bulk operations pay the flattening cost once.
+    flat = _flat_formula_cache.get(formula)
+    if flat is None:
+        flat = _FlatFormula(formula)
+        _flat_formula_cache[formula] = flat
+    return flat
+
+def truth_mask(formula: Formula, var_index: Mapping[str, int], n: int) -> int:
+    # Computes the formula's entire truth table as a single int of 2^n bits,
+    # where bit i is the formula's value in the i-th model of the `all_models`
+    # enumeration over the n variables ordered by `var_index`. Each connective
+    # then costs one big-int bitwise operation instead of 2^n evaluations.
+    return _flatten(formula).truth_mask(var_index, n)
+
+def _truth_mask_over_variables(formula: Formula) -> Tuple[int, int]:
+    # Shared entry point of is_tautology/is_contradiction/is_satisfiable: all
+    # three verdicts fall out of one mask computation, which never materializes
+    # per-model dicts, so there is nothing left to short-circuit per model —
+    # early exit could at best save part of one big-int pass.
+    vars_sorted = formula.variables_sorted()
+    n = len(vars_sorted)
+    var_index = {v: j for j, v in enumerate(vars_sorted)}
+    return truth_mask(formula, var_index, n), (1 << (1 << n)) - 1
 
 def is_tautology(formula: Formula) -> bool:
-    vars_list = sorted(formula.variables())
-    return all(evaluate(formula, model) for model in all_models(vars_list))
+    mask, all_ones = _truth_mask_over_variables(formula)
+    return mask == all_ones
 
 def is_contradiction(formula: Formula) -> bool:
-    vars_list = sorted(formula.variables())
-    return all(not evaluate(formula, model) for model in all_models(vars_list))
+    mask, _ = _truth_mask_over_variables(formula)
+    return mask == 0
 
 def is_satisfiable(formula: Formula) -> bool:
-    vars_list = sorted(formula.variables())
-    return any(evaluate(formula, model) for model in all_models(vars_list))
+    mask, _ = _truth_mask_over_variables(formula)
+    return mask != 0
+
+def _literal(variable: str, positive: bool) -> Formula:
+    return Formula(variable) if positive else Formula("~", Formula(variable))
+
+def _fold(op: str, formulas: Sequence[Formula]) -> Formula:
+    # Combines pairwise into a balanced tree rather than left-folding: a fold
+    # over 2^n clauses stays O(n) deep instead of O(2^n), so later traversals
+    # and stringification of the result don't hit pathological depth.
+    formulas = list(formulas)
+    while len(formulas) > 1:
+        combined = [Formula(op, a, b) for a, b in zip(formulas[::2], formulas[1::2])]
+        if len(formulas) % 2:
+            combined.append(formulas[-1])
+        formulas = combined
+    return formulas[0]
 
 def _synthesize_for_model(model: Model) -> Formula:
     assert is_model(model)
     assert len(model.keys()) > 0
-    literals = []
-    for v in sorted(model.keys()):
-        if model[v]:
-            literals.append(Formula(v))
-        else:
-            literals.append(Formula("~", Formula(v)))
-    if len(literals) == 1:
-        return literals[0]
-    conj = Formula("&", literals[0], literals[1])
-    for lit in literals[2:]:
-        conj = Formula("&", conj, lit)
-    return conj
+    return _fold("&", [_literal(v, model[v]) for v in sorted(model.keys())])
 
 def synthesize(variables: Sequence[str], values: Iterable[bool]) -> Formula:
     assert len(variables) > 0
-    models_list = list(all_models(variables))
+    literal_order = sorted(range(len(variables)), key=lambda j: variables[j])
     dnf_clauses = []
-    for model, truth in zip(models_list, values):
+    for row, truth in zip(all_models_rows(variables), values):
         if truth:
-            dnf_clauses.append(_synthesize_for_model(model))
+            dnf_clauses.append(_fold("&", [_literal(variables[j], row[j]) for j in literal_order]))
     if not dnf_clauses:
         p = variables[0]
         return Formula("&", Formula("~", Formula(p)), Formula(p))
-    if len(dnf_clauses) == 1:
-        return dnf_clauses[0]
-    disj = Formula("|", dnf_clauses[0], dnf_clauses[1])
-    for clause in dnf_clauses[2:]:
-        disj = Formula("|", disj, clause)
-    return disj
+    return _fold("|", dnf_clauses)
 
 def _synthesize_for_all_except_model(model: Model) -> Formula:
     assert is_model(model)
     assert len(model.keys()) > 0
-    literals = []
-    for v in sorted(model.keys()):
-        if model[v]:
-            literals.append(Formula("~", Formula(v)))
-        else:
-            literals.append(Formula(v))
-    if len(literals) == 1:
-        return literals[0]
-    disj = Formula("|", literals[0], literals[1])
-    for lit in literals[2:]:
-        disj = Formula("|", disj, lit)
-    return disj
+    return _fold("|", [_literal(v, not model[v]) for v in sorted(model.keys())])
 
 def synthesize_cnf(variables: Sequence[str], values: Iterable[bool]) -> Formula:
     assert len(variables) > 0
-    models_list = list(all_models(variables))
+    literal_order = sorted(range(len(variables)), key=lambda j: variables[j])
     cnf_clauses = []
-    for model, truth in zip(models_list, values):
+    for row, truth in zip(all_models_rows(variables), values):
         if not truth:
-            cnf_clauses.append(_synthesize_for_all_except_model(model))
+            cnf_clauses.append(_fold("|", [_literal(variables[j], not row[j]) for j in literal_order]))
     if not cnf_clauses:
         p = variables[0]
         return Formula("|", Formula(p), Formula("~", Formula(p)))
-    if len(cnf_clauses) == 1:
-        return cnf_clauses[0]
-    conj = Formula("&", cnf_clauses[0], cnf_clauses[1])
-    for clause in cnf_clauses[2:]:
-        conj = Formula("&", conj, clause)
-    return conj
+    return _fold("&", cnf_clauses)
 
 def evaluate_inference(rule: InferenceRule, model: Model) -> bool:
     assert is_model(model)
@@ -163,7 +413,15 @@ def is_sound_inference(rule: InferenceRule) -> bool:
     vars_set = set(rule.conclusion.variables())
     for assumption in rule.assumptions:
         vars_set |= assumption.variables()
-    for model in all_models(sorted(vars_set)):
-        if all(evaluate(a, model) for a in rule.assumptions) and not evaluate(rule.conclusion, model):
-            return False
-    return True
+    vars_sorted = sorted(vars_set)
+    n = len(vars_sorted)
+    var_index = {v: j for j, v in enumerate(vars_sorted)}
+    # The rule is sound iff no model satisfies all assumptions but not the
+    # conclusion; with one mask per formula over the shared variable order
+    # that is a handful of big-int operations instead of 2^n evaluations.
+    all_ones = (1 << (1 << n)) - 1
+    assumptions_mask = all_ones
+    for assumption in rule.assumptions:
+        assumptions_mask &= truth_mask(assumption, var_index, n)
+    conclusion_mask = truth_mask(rule.conclusion, var_index, n)
+    return assumptions_mask & (conclusion_mask ^ all_ones) == 0
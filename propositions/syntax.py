@@ -2,33 +2,112 @@
 """Syntactic handling of propositional formulas."""
 
 from __future__ import annotations
+import re
 from collections.abc import Callable
-from functools import lru_cache
-from typing import Mapping, Optional, Set, Tuple, Union
+from typing import AbstractSet, Mapping, Optional, Tuple, Union
+from weakref import WeakValueDictionary
 
-from logic_utils import frozen, memoized_parameterless_method
+from logic_utils import frozen
+
+# The classifier predicates below are called once or more per tree node on
+# every traversal; each test is a character comparison or a frozenset probe,
+# which is cheaper than the hash-and-lookup of the lru_cache they once wore.
+_VARIABLE_FIRST_CHARS = frozenset("pqrstuvwxyz")
+_CONSTANTS = frozenset("TF")
+_DIGITS = frozenset("0123456789")
+
+#: Matches the (possibly empty) decimal suffix of a variable name; always
+#: succeeds, so the whole digit run is consumed by one C-level call instead of
+#: a Python loop advancing one character at a time.
+_DIGIT_RUN = re.compile("[0-9]*")
+_BINARY_OPERATORS = frozenset({"&", "|", "->", "+", "<->", "-&", "-|"})
+
+#: Shared by every leaf's cached variable/operator sets; CPython does not
+#: intern the empty frozenset on its own.
+_EMPTY_SET: frozenset = frozenset()
 
 
-@lru_cache(maxsize=100)
 def is_variable(string: str) -> bool:
-    return string[0] >= "p" and string[0] <= "z" and (len(string) == 1 or string[1:].isdecimal())
+    # Matching the digit run in place avoids copying the suffix into a new
+    # string just to test it; the single-character case never reaches it.
+    n = len(string)
+    return string[0] in _VARIABLE_FIRST_CHARS and (n == 1 or _DIGIT_RUN.match(string, 1).end() == n)
 
 
-@lru_cache(maxsize=100)
 def is_constant(string: str) -> bool:
-    return string == "T" or string == "F"
+    return string in _CONSTANTS
 
 
-@lru_cache(maxsize=100)
 def is_unary(string: str) -> bool:
     return string == "~"
 
 
-@lru_cache(maxsize=100)
 def is_binary(string: str) -> bool:
-    return string in {'&', '|', '->', '+', '<->', '-&', '-|'}
+    return string in _BINARY_OPERATORS
+
+
+def _compile_template(template: Formula) -> Callable[[Optional[Formula], Optional[Formula]], Formula]:
+    # Precompiles a substitution template over the placeholders 'p' and 'q'
+    # into a closure instantiating it for given operands, so applying the same
+    # template at many nodes does not re-walk it or rebuild untouched parts.
+    # A placeholder with no corresponding operand stays as itself, matching
+    # substitute_variables on a map that lacks it. Templates are tiny, so the
+    # one-time recursive compilation is negligible.
+    root = template.root
+    if root == "p":
+        return lambda first, second: first if first is not None else template
+    if root == "q":
+        return lambda first, second: second if second is not None else template
+    if is_variable(root) or is_constant(root):
+        return lambda first, second: template
+    if is_unary(root):
+        build_first = _compile_template(template.first)
+        return lambda first, second: Formula(root, build_first(first, second))
+    build_first = _compile_template(template.first)
+    build_second = _compile_template(template.second)
+    return lambda first, second: Formula(root, build_first(first, second), build_second(first, second))
+
+
+# Kinds of the characters that may start a token inside a formula, plus the
+# jump table classifying a character in one dict probe; the parser branches on
+# the resulting small int instead of re-testing the character against each
+# class in turn.
+_KIND_NEGATION = 0
+_KIND_OPEN = 1
+_KIND_VARIABLE = 2
+_KIND_CONSTANT = 3
+
+_CHAR_KIND = {"~": _KIND_NEGATION, "(": _KIND_OPEN}
+_CHAR_KIND.update({c: _KIND_VARIABLE for c in _VARIABLE_FIRST_CHARS})
+_CHAR_KIND.update({c: _KIND_CONSTANT for c in _CONSTANTS})
+
+def _match_binary_operator(string: str, i: int, n: int) -> Tuple[Optional[str], int]:
+    # Matches the binary operator starting at position i (the caller
+    # guarantees i < n) by direct character reads — one for '&', '|' and '+',
+    # a second one for the '-' family, two more for '<->' — so no position is
+    # examined twice and no candidate list is walked. Returns the operator and
+    # the position after it, or (None, i).
+    c = string[i]
+    if c == "&" or c == "|" or c == "+":
+        return c, i + 1
+    if c == "-" and i + 1 < n:
+        c = string[i + 1]
+        if c == ">":
+            return "->", i + 2
+        if c == "&":
+            return "-&", i + 2
+        if c == "|":
+            return "-|", i + 2
+    elif c == "<" and i + 2 < n and string[i + 1] == "-" and string[i + 2] == ">":
+        return "<->", i + 3
+    return None, i
 
 
+#: Every character that may appear in a well-formed formula; strings
+#: containing anything else are rejected by a single C-speed scan before the
+#: per-character parsing loop runs.
+_ALLOWED_CHARS = frozenset("pqrstuvwxyz0123456789TF~()&|+<->")
+
 @frozen
 class Formula:
     """An immutable propositional formula in tree representation, composed from
@@ -43,57 +122,146 @@ class Formula:
     first: Optional[Formula]
     second: Optional[Formula]
 
+    # No per-instance __dict__: the caches below live in fixed slots, shrinking
+    # every node and turning each cache probe into a direct slot read. The
+    # __weakref__ slot keeps the weak intern table (and the weakly-keyed flat-
+    # program cache in semantics) working without a __dict__.
+    __slots__ = ("root", "first", "second", "_hash", "_variables", "_operators",
+                 "_repr", "_variables_sorted", "__weakref__")
+
+    #: Hash-consing table: structurally equal formulas constructed through
+    #: `Formula(...)` are collapsed into a single shared instance, so subtrees
+    #: are shared across formulas and equality is usually a pointer comparison.
+    _intern: WeakValueDictionary = WeakValueDictionary()
+
+    def __new__(cls, root: str, first: Optional[Formula] = None, second: Optional[Formula] = None):
+        key = (root, first, second)
+        instance = cls._intern.get(key)
+        if instance is None:
+            instance = super().__new__(cls)
+            cls._intern[key] = instance
+        return instance
+
     def __init__(self, root: str, first: Optional[Formula] = None, second: Optional[Formula] = None):
-        if is_variable(root) or is_constant(root):
+        if hasattr(self, "_hash"):
+            # Re-initialization of an instance returned from the intern table:
+            # the arguments are identical by construction of the intern key,
+            # so there is nothing to validate or recompute.
+            return
+        # The structural hash and the variables/operators frozensets are
+        # assembled from the children's already-computed ones, so each is O(1)
+        # to query afterwards and shared between all formulas containing the
+        # same interned subtree.
+        if is_variable(root):
             assert first is None and second is None
             self.root = root
+            self._hash = hash(root)
+            self._variables = frozenset((root,))
+            self._operators = _EMPTY_SET
+        elif is_constant(root):
+            assert first is None and second is None
+            self.root = root
+            self._hash = hash(root)
+            self._variables = _EMPTY_SET
+            self._operators = frozenset((root,))
         elif is_unary(root):
             assert first is not None and second is None
             self.root, self.first = root, first
+            self._hash = hash((root, first._hash))
+            self._variables = first._variables
+            self._operators = frozenset((root,)) | first._operators
         else:
             assert is_binary(root)
             assert first is not None and second is not None
             self.root, self.first, self.second = root, first, second
+            self._hash = hash((root, first._hash, second._hash))
+            self._variables = first._variables | second._variables
+            self._operators = frozenset((root,)) | first._operators | second._operators
+        self._repr = None
+        self._variables_sorted = None
 
-    @memoized_parameterless_method
     def __repr__(self) -> str:
-        if is_variable(self.root):
-            return self.root
-        elif is_constant(self.root):
-            return self.root
-        elif is_unary(self.root):
-            return self.root + str(self.first)
-        return "(" + str(self.first) + self.root + str(self.second) + ")"
+        # A hand-rolled cache in `_repr` rather than memoized_parameterless_method,
+        # so the post-order walk below can populate the representation of every
+        # subformula on the way up: later reprs of any (interned, hence shared)
+        # subtree are O(1) lookups, and each node's string is joined exactly once.
+        rep = self._repr
+        if rep is not None:
+            return rep
+        work = [(self, False)]
+        while work:
+            node, ready = work.pop()
+            if node._repr is not None:
+                continue
+            root = node.root
+            if is_variable(root) or is_constant(root):
+                object.__setattr__(node, "_repr", root)
+            elif not ready:
+                work.append((node, True))
+                if not is_unary(root):
+                    work.append((node.second, False))
+                work.append((node.first, False))
+            elif is_unary(root):
+                object.__setattr__(node, "_repr", f"{root}{node.first._repr}")
+            else:
+                # An f-string builds the five-part string in one BUILD_STRING
+                # op, with no intermediate concatenations and no parts tuple.
+                object.__setattr__(node, "_repr", f"({node.first._repr}{root}{node.second._repr})")
+        return self._repr
+
+    def __reduce__(self) -> Tuple:
+        # Routes copying and pickling back through the interning constructor:
+        # a deep copy or unpickle of a formula folds into the already-shared
+        # instances instead of bypassing `__new__` (which would also fail, as
+        # it requires the root).
+        return Formula, (self.root, getattr(self, "first", None), getattr(self, "second", None))
 
     def __eq__(self, other: object) -> bool:
-        return isinstance(other, Formula) and str(self) == str(other)
+        # Interning makes structurally equal formulas identical, so the
+        # identity test is the common success path; the walk below only runs
+        # for instances minted outside the intern table, and short-circuits on
+        # the first mismatch instead of materializing both reprs to compare.
+        if self is other:
+            return True
+        if not isinstance(other, Formula) or self._hash != other._hash:
+            return False
+        stack = [(self, other)]
+        while stack:
+            x, y = stack.pop()
+            if x is y:
+                continue
+            root = x.root
+            if root != y.root:
+                return False
+            if is_unary(root):
+                stack.append((x.first, y.first))
+            elif is_binary(root):
+                stack.append((x.first, y.first))
+                stack.append((x.second, y.second))
+        return True
 
     def __ne__(self, other: object) -> bool:
         return not self == other
 
     def __hash__(self) -> int:
-        return hash(str(self))
-
-    @memoized_parameterless_method
-    def variables(self) -> Set[str]:
-        if is_variable(self.root):
-            return {self.root}
-        elif is_constant(self.root):
-            return set()
-        vars_set = self.first.variables()
-        if is_unary(self.root):
-            return vars_set
-        return vars_set.union(self.second.variables())
-
-    @memoized_parameterless_method
-    def operators(self) -> Set[str]:
-        if is_variable(self.root):
-            return set()
-        elif is_constant(self.root):
-            return {self.root}
-        if is_unary(self.root):
-            return {self.root}.union(self.first.operators())
-        return {self.root}.union(self.first.operators()).union(self.second.operators())
+        return self._hash
+
+    def variables(self) -> AbstractSet[str]:
+        return self._variables
+
+    def variables_sorted(self) -> Tuple[str, ...]:
+        # The sorted variable order is what every truth-table-shaped
+        # computation starts from; cached in its slot so a shared formula pays
+        # the sort once rather than per query. (memoized_parameterless_method
+        # would mint a new instance attribute, which __slots__ rules out.)
+        result = self._variables_sorted
+        if result is None:
+            result = tuple(sorted(self._variables))
+            object.__setattr__(self, "_variables_sorted", result)
+        return result
+
+    def operators(self) -> AbstractSet[str]:
+        return self._operators
 
     @staticmethod
     def __is_char_like(string: str, index: int, func: Callable[[str], bool]) -> bool:
@@ -103,47 +271,123 @@ class Formula:
 
     @staticmethod
     def _parse_prefix(string: str) -> Tuple[Union[Formula, None], str]:
-        if not string:
-            return None, "Empty string"
-        if is_variable(string[0]):
-            i = 1
-            while i < len(string) and string[i].isdigit():
-                i += 1
-            var = string[:i]
-            return Formula(var), string[i:]
-        if is_constant(string[0]):
-            return Formula(string[0]), string[1:]
-        if is_unary(string[0]):
-            operand, remaining = Formula._parse_prefix(string[1:])
-            if operand is None:
-                return None, "Expected operand after unary operator '~'"
-            return Formula(string[0], operand), remaining
-        if string[0] == '(':
-            first, remaining = Formula._parse_prefix(string[1:])
-            if first is None:
-                return None, "Expected first operand after '('"
-            bin_ops = ["<->", "->", "-&", "-|", "+", "&", "|"]
-            operator = None
-            for op in bin_ops:
-                if remaining.startswith(op):
-                    operator = op
-                    remaining = remaining[len(op):]
-                    break
-            if operator is None:
-                return None, f"Expected binary operator after first operand, found: '{remaining[:3]}'"
-            second, remaining = Formula._parse_prefix(remaining)
-            if second is None:
+        # A single left-to-right pass over an index cursor: no recursion and no
+        # intermediate slices of the input. The stack holds '~' markers, '('
+        # markers awaiting their binary operator, and (operator, first-operand)
+        # frames awaiting their second operand.
+        # The loop body runs per character; binding the module-level tables and
+        # the constructor to locals turns each of those global lookups into a
+        # fast local read — the closest pure-Python analogue of declaring them
+        # as typed locals in a compiled extension.
+        char_kind_get = _CHAR_KIND.get
+        digit_run_match = _DIGIT_RUN.match
+        make = Formula
+        n = len(string)
+        i = 0
+        stack = []
+        while True:
+            if i == n:
+                if not stack:
+                    return None, "Empty string"
+                top = stack[-1]
+                if top == "~":
+                    return None, "Expected operand after unary operator '~'"
+                if top == "(":
+                    return None, "Expected first operand after '('"
                 return None, "Expected second operand after operator"
-            if not remaining.startswith(')'):
-                return None, "Expected ')' after second operand"
-            remaining = remaining[1:]
-            return Formula(operator, first, second), remaining
-        return None, f"Unexpected character: '{string[0]}'"
+            c = string[i]
+            kind = char_kind_get(c)
+            if kind == _KIND_NEGATION:
+                stack.append("~")
+                i += 1
+                continue
+            if kind == _KIND_OPEN:
+                stack.append("(")
+                i += 1
+                continue
+            if kind == _KIND_VARIABLE:
+                j = digit_run_match(string, i + 1).end()
+                formula = make(string[i:j])
+                i = j
+            elif kind == _KIND_CONSTANT:
+                formula = make(c)
+                i += 1
+            else:
+                return None, f"Unexpected character: '{c}'"
+            # Reduce every context the completed subformula closes: pending
+            # negations, then a binary frame whose ')' must follow.
+            while True:
+                while stack and stack[-1] == "~":
+                    stack.pop()
+                    formula = make("~", formula)
+                if stack and type(stack[-1]) is tuple:
+                    if i == n or string[i] != ")":
+                        return None, "Expected ')' after second operand"
+                    i += 1
+                    operator, first = stack.pop()
+                    formula = make(operator, first, formula)
+                    continue
+                break
+            if stack:
+                # The top of the stack is a '(' whose first operand has just
+                # been completed; its binary operator must follow.
+                operator = None
+                if i < n:
+                    operator, i = _match_binary_operator(string, i, n)
+                if operator is None:
+                    return None, f"Expected binary operator after first operand, found: '{string[i:i + 3]}'"
+                stack[-1] = (operator, formula)
+                continue
+            return formula, string[i:]
 
     @staticmethod
     def is_formula(string: str) -> bool:
-        formula, remaining = Formula._parse_prefix(string)
-        return formula is not None and remaining == ''
+        # A pure classification pass: the same grammar as _parse_prefix walked
+        # with an index cursor and a stack of int states, but no Formula node
+        # is ever allocated — so validating (including the one parse performs
+        # before building) costs character reads only. Each stack entry is one
+        # open '(': 0 until its binary operator has been read, 1 afterwards,
+        # when only the second operand and ')' remain.
+        if not string or not _ALLOWED_CHARS.issuperset(string):
+            return False
+        char_kind_get = _CHAR_KIND.get
+        digit_run_match = _DIGIT_RUN.match
+        n = len(string)
+        i = 0
+        stack = []
+        while True:
+            # Expect an operand: negations need no bookkeeping here, since
+            # validation has nothing to build when they resolve.
+            while i < n and string[i] == "~":
+                i += 1
+            if i == n:
+                return False
+            kind = char_kind_get(string[i])
+            if kind == _KIND_OPEN:
+                stack.append(0)
+                i += 1
+                continue
+            if kind == _KIND_VARIABLE:
+                i = digit_run_match(string, i + 1).end()
+            elif kind == _KIND_CONSTANT:
+                i += 1
+            else:
+                return False
+            # An operand is complete; every frame already holding its operator
+            # is closed by a ')' here.
+            while stack and stack[-1]:
+                if i == n or string[i] != ")":
+                    return False
+                i += 1
+                stack.pop()
+            if not stack:
+                return i == n
+            if i == n:
+                return False
+            operator, i = _match_binary_operator(string, i, n)
+            if operator is None:
+                return False
+            stack[-1] = 1
 
     @staticmethod
     def parse(string: str) -> Formula:
@@ -161,33 +405,77 @@ class Formula:
     def substitute_variables(self, substitution_map: Mapping[str, Formula]) -> Formula:
         for variable in substitution_map:
             assert is_variable(variable)
-        if is_variable(self.root):
-            return substitution_map[self.root] if self.root in substitution_map else self
-        elif is_constant(self.root):
-            return self
-        elif is_unary(self.root):
-            return Formula(self.root, self.first.substitute_variables(substitution_map))
-        else:
-            return Formula(self.root, self.first.substitute_variables(substitution_map),
-                           self.second.substitute_variables(substitution_map))
+        keys = substitution_map.keys()
+        work = [(self, False)]
+        values = []
+        while work:
+            node, ready = work.pop()
+            # A subtree mentioning none of the substituted variables is
+            # returned as-is, shared, without being rebuilt or descended into.
+            if not ready and node._variables.isdisjoint(keys):
+                values.append(node)
+                continue
+            root = node.root
+            if is_variable(root):
+                values.append(substitution_map[root] if root in substitution_map else node)
+            elif is_constant(root):
+                values.append(node)
+            elif not ready:
+                work.append((node, True))
+                if not is_unary(root):
+                    work.append((node.second, False))
+                work.append((node.first, False))
+            elif is_unary(root):
+                first = values.pop()
+                # Identical operands mean an untouched node (e.g. a variable
+                # mapped to itself): reuse it without even an intern probe.
+                values.append(node if first is node.first else Formula(root, first))
+            else:
+                second = values.pop()
+                first = values.pop()
+                if first is node.first and second is node.second:
+                    values.append(node)
+                else:
+                    values.append(Formula(root, first, second))
+        return values[0]
 
     def substitute_operators(self, substitution_map: Mapping[str, Formula]) -> Formula:
         for operator in substitution_map:
             assert is_constant(operator) or is_unary(operator) or is_binary(operator)
             assert substitution_map[operator].variables().issubset({"p", "q"})
-        if is_variable(self.root) or is_constant(self.root):
-            new_self = self
-        elif is_unary(self.root):
-            new_self = Formula(self.root, self.first.substitute_operators(substitution_map))
-        else:
-            new_self = Formula(self.root, self.first.substitute_operators(substitution_map),
-                                self.second.substitute_operators(substitution_map))
-        if new_self.root in substitution_map:
-            sub_map = {}
-            if hasattr(new_self, "first") and new_self.first is not None:
-                sub_map["p"] = new_self.first
-            if hasattr(new_self, "second") and new_self.second is not None:
-                sub_map["q"] = new_self.second
-            return substitution_map[new_self.root].substitute_variables(sub_map)
-        else:
-            return new_self
+        templates = {operator: _compile_template(substitution_map[operator]) for operator in substitution_map}
+        keys = substitution_map.keys()
+        work = [(self, False)]
+        values = []
+        while work:
+            node, ready = work.pop()
+            # A subtree containing none of the substituted operators (which
+            # covers variables, whose operator set is empty) is kept shared.
+            if not ready and node._operators.isdisjoint(keys):
+                values.append(node)
+                continue
+            root = node.root
+            if not ready and not is_constant(root):
+                work.append((node, True))
+                if not is_unary(root):
+                    work.append((node.second, False))
+                work.append((node.first, False))
+                continue
+            if is_constant(root):
+                first = second = None
+            elif is_unary(root):
+                first, second = values.pop(), None
+            else:
+                second = values.pop()
+                first = values.pop()
+            if root in templates:
+                values.append(templates[root](first, second))
+            elif first is None:
+                values.append(node)
+            elif second is None:
+                values.append(node if first is node.first else Formula(root, first))
+            elif first is node.first and second is node.second:
+                values.append(node)
+            else:
+                values.append(Formula(root, first, second))
+        return values[0]